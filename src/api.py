@@ -1,13 +1,18 @@
 
 import os
-import pickle
+import asyncio
+import hashlib
+import json
 import faiss
 import numpy as np
+import pyarrow as pa
+from collections import OrderedDict
 from typing import List
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from openai import OpenAI
-from sentence_transformers import SentenceTransformer
+from openai import AsyncOpenAI
+from embedder import load_embed_model, threads_per_worker, EMBED_BATCH_SIZE
+from embed_index import CHUNK_ID_BITS
 from validate_agent import validate_llm_output
 
 # == CONFIGURAÇÕES ==
@@ -16,29 +21,50 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 if openai_api_key is None:
     raise RuntimeError("Defina a variável de ambiente OPENAI_API_KEY com sua chave da OpenAI.")
 
-client = OpenAI(api_key=openai_api_key)
+client = AsyncOpenAI(api_key=openai_api_key)
 
 INDEX_PATH = "faiss_index.bin"
-META_PATH = "doc_metadata.pkl"
+META_PATH = "doc_metadata.arrow"
+EMBS_PATH = "chunk_embs.npy"
 EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
 TOP_K = 5
+HNSW_EF_SEARCH = 16   # candidatos explorados por busca no grafo HNSW
+BATCH_SIZE = 64       # máximo de perguntas por micro-batch
+MAX_WAIT_MS = 50      # janela de espera para agrupar perguntas
+RETRIEVAL_TIMEOUT_S = 30  # tempo máximo que o /ask espera pelo micro-batch
+CACHE_SIZE = 4096     # entradas nos caches de recuperação e de respostas da LLM
 
 print("Carregando modelo de embeddings...")
-embed_model = SentenceTransformer(EMBED_MODEL_NAME)
+embed_model = load_embed_model(EMBED_MODEL_NAME)
 
 print("Carregando índice FAISS e metadata...")
-if not os.path.exists(INDEX_PATH) or not os.path.exists(META_PATH):
+if not all(os.path.exists(p) for p in (INDEX_PATH, META_PATH, EMBS_PATH)):
     raise RuntimeError("Índice FAISS ou metadata não encontrados. Execute embed_and_index.py primeiro.")
-index = faiss.read_index(INDEX_PATH)
-with open(META_PATH, "rb") as f:
-    meta_data = pickle.load(f)
-chunks_texts: List[str] = meta_data["chunks"]
-chunks_meta: List[tuple[str, int]] = meta_data["metadata"]
+#índice aberto via mmap e somente leitura: com vários workers o SO mantém uma única cópia dos vetores
+#(IO_FLAG_MMAP_IFC mapeia os vetores do HNSWFlat sem cópia; versões antigas do FAISS só têm IO_FLAG_MMAP)
+INDEX_IO_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+index = faiss.read_index(INDEX_PATH, INDEX_IO_FLAGS)
+#a busca de um micro-batch (B, d) é paralelizada pelo FAISS entre as perguntas
+faiss.omp_set_num_threads(threads_per_worker())
+#o HNSW fica dentro do IndexIDMap2
+hnsw_index = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+if hasattr(hnsw_index, "hnsw"):
+    hnsw_index.hnsw.efSearch = HNSW_EF_SEARCH
+#memory map: as páginas ficam no cache do SO (compartilhadas entre workers) e
+#cada string só vira objeto Python quando é acessada
+meta_table = pa.ipc.open_file(pa.memory_map(META_PATH, "r")).read_all()
+#ChunkedArray direto do mmap (combine_chunks copiaria a coluna inteira para o heap)
+chunks_texts = meta_table.column("chunk")
+doc_names: List[str] = json.loads(meta_table.schema.metadata[b"docs"])
+doc_offsets: List[int] = json.loads(meta_table.schema.metadata[b"doc_offsets"])
+CHUNK_IDX_MASK = (1 << CHUNK_ID_BITS) - 1
+#embeddings dos chunks calculados na indexação, lidos sob demanda do disco
+chunk_embs_all = np.load(EMBS_PATH, mmap_mode="r")
 
 app = FastAPI(
     title="RAG com OpenAI 1.x",
     version="1.0",
-    description="API RAG usando FAISS + sentence-transformers + OpenAI v1.x"
+    description="API RAG usando FAISS + MiniLM (ONNX Runtime) + OpenAI v1.x"
 )
 
 class QueryRequest(BaseModel):
@@ -48,31 +74,105 @@ class QueryResponse(BaseModel):
     answer: str
     retrieved_chunks: List[str]
 
-def retrieve_top_k_chunks(query: str, k: int = TOP_K):
-    q_emb = embed_model.encode([query], convert_to_numpy=True)
-    distances, indices = index.search(q_emb, k)
-    indices = indices[0]
+# == CACHES ==
+
+def hash_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+#cache LRU simples: chave -> valor
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is not None:
+            self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+#cache LRU pergunta -> (embedding, índices), guardando tudo em linhas de arrays pré-alocados
+class RetrievalCache:
+    def __init__(self, maxsize: int, dim: int, k: int):
+        self.maxsize = maxsize
+        self.embs = np.empty((maxsize, dim), dtype=np.float32)
+        self.indices = np.empty((maxsize, k), dtype=np.int64)
+        self.slots: OrderedDict = OrderedDict()  # chave -> linha nos arrays
+
+    def get(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            return None
+        self.slots.move_to_end(key)
+        return self.embs[slot], self.indices[slot]
+
+    def put(self, key, emb: np.ndarray, indices: np.ndarray):
+        if key in self.slots:
+            slot = self.slots.pop(key)
+        elif len(self.slots) < self.maxsize:
+            slot = len(self.slots)
+        else:
+            #reaproveita a linha da entrada menos usada
+            _, slot = self.slots.popitem(last=False)
+        self.embs[slot] = emb
+        self.indices[slot] = indices
+        self.slots[key] = slot
+
+retrieval_cache = RetrievalCache(CACHE_SIZE, index.d, TOP_K)
+llm_cache = LRUCache(CACHE_SIZE)
+
+#embeda todas as perguntas de uma vez e faz uma única busca no FAISS
+def search_batch(queries: List[str], k: int = TOP_K):
+    q_embs = embed_model.encode(queries, convert_to_numpy=True, batch_size=EMBED_BATCH_SIZE)
+    q_embs = np.ascontiguousarray(q_embs, dtype=np.float32)  # shape (B, d)
+    faiss.normalize_L2(q_embs)
+    distances, indices = index.search(q_embs, k)
+    return q_embs, indices
+
+#decodifica uma linha de ids do FAISS ((doc_id << CHUNK_ID_BITS) | chunk_idx) nos textos,
+#metadata e posições dos chunks
+def lookup_chunks(ids):
     retrieved_texts = []
     retrieved_meta = []
-    for idx in indices:
-        if 0 <= idx < len(chunks_texts):
-            retrieved_texts.append(chunks_texts[idx])
-            retrieved_meta.append(chunks_meta[idx])
-    return retrieved_texts, retrieved_meta
+    retrieved_indices = []
+    for chunk_id in ids:
+        #o FAISS devolve -1 quando encontra menos de k vizinhos
+        if chunk_id < 0:
+            continue
+        chunk_id = int(chunk_id)
+        doc_id = chunk_id >> CHUNK_ID_BITS
+        chunk_idx = chunk_id & CHUNK_IDX_MASK
+        row = doc_offsets[doc_id] + chunk_idx
+        retrieved_texts.append(chunks_texts[row].as_py())
+        retrieved_meta.append((doc_names[doc_id], chunk_idx))
+        retrieved_indices.append(row)
+    return retrieved_texts, retrieved_meta, retrieved_indices
+
+def retrieve_top_k_chunks(query: str, k: int = TOP_K):
+    _, indices = search_batch([query], k)
+    return lookup_chunks(indices[0])
 
 def build_prompt(question: str, retrieved_texts: List[str]) -> str:
-    prompt = "Você é um assistente que responde com base no contexto fornecido.\n"
-    prompt += "====== CONTEXTO RECUPERADO ======\n"
-    for i, chunk in enumerate(retrieved_texts):
-        prompt += f"CHUNK {i+1}:\n{chunk}\n\n"
-    prompt += "====== PERGUNTA ======\n"
-    prompt += question + "\n\n"
-    prompt += "Com base no contexto acima, responda de forma objetiva:"
-    return prompt
-
-def call_openai(prompt: str) -> str:
+    parts = [
+        "Você é um assistente que responde com base no contexto fornecido.\n"
+        "====== CONTEXTO RECUPERADO ======\n"
+    ]
+    parts.extend(f"CHUNK {i+1}:\n{chunk}\n\n" for i, chunk in enumerate(retrieved_texts))
+    parts.append(
+        f"====== PERGUNTA ======\n{question}\n\n"
+        "Com base no contexto acima, responda de forma objetiva:"
+    )
+    return "".join(parts)
+
+async def call_openai(prompt: str) -> str:
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-3.5-turbo",  # ou “gpt-4”
             messages=[
                 {"role": "system", "content": "Você é um assistente útil."},
@@ -85,23 +185,106 @@ def call_openai(prompt: str) -> str:
     except Exception as e:
         raise RuntimeError(f"Erro ao chamar OpenAI (nova interface): {e}")
 
+#evita chamar a OpenAI de novo para um prompt já respondido
+async def call_openai_cached(prompt: str) -> str:
+    prompt_key = hash_key(prompt)
+    llm_output = llm_cache.get(prompt_key)
+    if llm_output is None:
+        llm_output = await call_openai(prompt)
+        llm_cache.put(prompt_key, llm_output)
+    return llm_output
+
+# == MICRO-BATCHING ==
+
+#fila de (pergunta, future) preenchida pelo /ask e consumida pelo batch_worker
+query_queue: asyncio.Queue = None
+#referência à task do worker (evita que seja coletada pelo GC e permite cancelar no shutdown)
+batch_worker_task: asyncio.Task = None
+
+#agrupa perguntas por até MAX_WAIT_MS (ou BATCH_SIZE itens) e resolve cada future com seus chunks
+async def batch_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await query_queue.get()]
+        deadline = loop.time() + MAX_WAIT_MS / 1000
+        while len(batch) < BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(query_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        questions = [question for question, _ in batch]
+        try:
+            #encode + busca rodam fora do event loop para não bloquear as outras requisições
+            q_embs, indices = await loop.run_in_executor(None, search_batch, questions)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for (question, future), q_emb, row in zip(batch, q_embs, indices):
+            #a requisição pode ter sido cancelada pelo cliente (ou por timeout) enquanto esperava
+            if future.done():
+                continue
+            #um erro numa pergunta (ex.: índice e metadata fora de sincronia) não pode derrubar o worker
+            try:
+                result = lookup_chunks(row)
+                retrieval_cache.put(hash_key(question), q_emb, row)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+@app.on_event("startup")
+async def start_batch_worker():
+    global query_queue, batch_worker_task
+    query_queue = asyncio.Queue()
+    batch_worker_task = asyncio.create_task(batch_worker())
+
+@app.on_event("shutdown")
+async def stop_batch_worker():
+    if batch_worker_task is not None:
+        batch_worker_task.cancel()
+        try:
+            await batch_worker_task
+        except asyncio.CancelledError:
+            pass
+
 @app.post("/ask", response_model=QueryResponse)
-def ask(request: QueryRequest):
+async def ask(request: QueryRequest):
     question = request.question.strip()
     if not question:
         raise HTTPException(status_code=400, detail="A pergunta não pode ser vazia.")
 
-    # 1. Recuperar top-K chunks
-    retrieved_texts, retrieved_meta = retrieve_top_k_chunks(question)
+    loop = asyncio.get_running_loop()
+
+    # 1. Recuperar top-K chunks (do cache ou via micro-batch)
+    cached = retrieval_cache.get(hash_key(question))
+    if cached is not None:
+        retrieved_texts, retrieved_meta, retrieved_indices = lookup_chunks(cached[1])
+    else:
+        future = loop.create_future()
+        await query_queue.put((question, future))
+        try:
+            retrieved_texts, retrieved_meta, retrieved_indices = await asyncio.wait_for(future, RETRIEVAL_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Tempo esgotado ao recuperar os chunks.")
 
     # 2. Montar prompt
     prompt = build_prompt(question, retrieved_texts)
 
-    # 3. Chamar OpenAI
-    llm_output = call_openai(prompt)
+    # 3. Chamar OpenAI (as chamadas de requisições concorrentes se sobrepõem no event loop)
+    llm_output = await call_openai_cached(prompt)
 
-    # 4. Validar saída
-    is_valid, validation_info = validate_llm_output(llm_output, question, retrieved_texts)
+    # 4. Validar saída (embeddings dos chunks vêm da indexação, só a resposta é embedada)
+    chunk_embs = chunk_embs_all[retrieved_indices]
+    is_valid, validation_info = await loop.run_in_executor(
+        None, validate_llm_output, llm_output, question, retrieved_texts, chunk_embs
+    )
     if not is_valid:
         raise HTTPException(
             status_code=502,
@@ -1,48 +1,73 @@
 import os
-import pickle
+import json
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+import pyarrow as pa
+from embedder import load_sentence_transformer, EMBED_BATCH_SIZE
 from ingestion import load_documents, split_into_chunk
 
 MODEL_NAME = "all-MiniLM-L6-v2"
+HNSW_M = 32                 # vizinhos por nó no grafo HNSW
+HNSW_EF_CONSTRUCTION = 40
+CHUNK_ID_BITS = 20          # id no FAISS = (doc_id << CHUNK_ID_BITS) | chunk_idx
 
 #gera o embedding para cada chunck e indexa o embedding no faiss
 def building_embedding_index(
         docs_folder : str,
         index_path: str = "faiss_index.bin",
-        meta_path: str = "doc_metadata.pkl",
+        meta_path: str = "doc_metadata.arrow",
+        embs_path: str = "chunk_embs.npy",
 ):
     #carrega os documentos e gera uma chunk para cada um
     documents = load_documents(docs_folder)
     all_chunks = []
-    metadata = []
-    for doc_name, content in documents.items():
+    doc_names = []
+    doc_offsets = []  # posição do primeiro chunk de cada documento em all_chunks
+    ids = []
+    for doc_id, (doc_name, content) in enumerate(documents.items()):
         chunks = split_into_chunk (content)
-        for idx, chunk in enumerate(chunks):
-            all_chunks.append(chunk)
-            metadata.append((doc_name, idx))
+        if len(chunks) > 1 << CHUNK_ID_BITS:
+            raise ValueError(f"{doc_name} gerou {len(chunks)} chunks, o máximo por documento é {1 << CHUNK_ID_BITS}.")
+        doc_names.append(doc_name)
+        doc_offsets.append(len(all_chunks))
+        all_chunks.extend(chunks)
+        ids.extend((doc_id << CHUNK_ID_BITS) | idx for idx in range(len(chunks)))
     
     #carrega o modelo que vai gerar o embedding
-    model = SentenceTransformer(MODEL_NAME)
-    #produz um array de numpy
-    embeddings = model.encode(all_chunks, show_progress_bar=True, convert_to_numpy=True)
+    model = load_sentence_transformer(MODEL_NAME)
 
-    #criando indece FAISS
+    #produz um array de numpy (o encode já ordena os textos por tamanho antes de montar os batches)
+    embeddings = model.encode(all_chunks, batch_size=EMBED_BATCH_SIZE, show_progress_bar=True, convert_to_numpy=True)
+
+    #normaliza os vetores: produto interno entre vetores unitários = similaridade do cosseno
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+
+    #criando indece FAISS (grafo HNSW, busca aproximada em O(log N))
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim) #indice de similiaridade L2
-    index.add (embeddings)
+    hnsw_index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    hnsw_index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    #a busca já devolve (documento, chunk) codificados no id, sem lista de metadata em Python
+    index = faiss.IndexIDMap2(hnsw_index)
+    index.add_with_ids(embeddings, np.array(ids, dtype=np.int64))
 
     faiss.write_index(index,index_path)
-    with open (meta_path, "wb") as f :
-        pickle.dump({
-            "chunks": all_chunks,
-            "metadata": metadata
-        },f)
+    #embeddings (já normalizados) na ordem dos chunks, para a validação não precisar re-embedar
+    np.save(embs_path, embeddings)
+    #textos em formato colunar (Arrow IPC) para serem lidos via memory map pela API;
+    #nomes e offsets dos documentos vão no metadata do schema para decodificar os ids
+    table = pa.table(
+        {"chunk": pa.array(all_chunks, type=pa.large_string())},
+        metadata={"docs": json.dumps(doc_names), "doc_offsets": json.dumps(doc_offsets)},
+    )
+    with pa.OSFile(meta_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
 
     print(f"=== Index criado com {len(all_chunks)} chunks (dim={dim}) ===")
     print(f"indece Faiss salvo em: {index_path}")
     print(f"metadata salvo em: {meta_path}")
+    print(f"embeddings salvos em: {embs_path}")
 
 if __name__ == "__main__":
     building_embedding_index(docs_folder="C:\\RAG\\Docs")
\ No newline at end of file
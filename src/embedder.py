@@ -0,0 +1,128 @@
+import os
+from functools import lru_cache, wraps
+from typing import List, Union
+import numpy as np
+
+HF_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_DIR = "onnx_minilm"
+ONNX_MODEL_FILE = "model.int8.onnx"
+MAX_SEQ_LENGTH = 256
+EMBED_BATCH_SIZE = 64
+
+#threads de CPU que cada processo pode usar (FAISS, torch, ONNX Runtime); com N workers
+#do uvicorn defina RAG_THREADS_PER_WORKER=nproc/N para não disputar os núcleos
+def threads_per_worker() -> int:
+    return max(1, int(os.getenv("RAG_THREADS_PER_WORKER", os.cpu_count())))
+
+#exporta o modelo para ONNX (eixos dinâmicos) e gera a versão quantizada em INT8
+def export_onnx_model(onnx_dir: str = ONNX_DIR):
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from transformers import AutoTokenizer
+
+    model = ORTModelForFeatureExtraction.from_pretrained(HF_MODEL_ID, export=True)
+    model.save_pretrained(onnx_dir)
+    AutoTokenizer.from_pretrained(HF_MODEL_ID).save_pretrained(onnx_dir)
+
+    quantize_dynamic(
+        os.path.join(onnx_dir, "model.onnx"),
+        os.path.join(onnx_dir, ONNX_MODEL_FILE),
+        weight_type=QuantType.QInt8,
+    )
+    print(f"Modelo ONNX INT8 salvo em: {os.path.join(onnx_dir, ONNX_MODEL_FILE)}")
+
+#modelo MiniLM quantizado rodando no onnxruntime, com a mesma interface de encode do SentenceTransformer
+class OnnxEmbedder:
+
+    def __init__(self, onnx_dir: str = ONNX_DIR, model_file: str = ONNX_MODEL_FILE):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir, use_fast=True)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads_per_worker()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(onnx_dir, model_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = EMBED_BATCH_SIZE,
+        convert_to_numpy: bool = True,
+        **kwargs,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        all_embs = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start : start + batch_size]
+            tokens = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors="np",
+            )
+            feeds = {
+                name: tokens[name].astype(np.int64)
+                for name in self.input_names
+                if name in tokens
+            }
+            last_hidden_state = self.session.run(None, feeds)[0]
+
+            #mean pooling considerando só os tokens reais + normalização L2
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            summed = (last_hidden_state * mask).sum(axis=1)
+            embs = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+            embs /= np.clip(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12, None)
+            all_embs.append(embs.astype(np.float32))
+
+        embeddings = np.concatenate(all_embs) if all_embs else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+#carrega o SentenceTransformer na GPU em FP16 quando houver CUDA, senão na CPU
+def load_sentence_transformer(model_name: str):
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    #usa os núcleos reservados para este processo nas matmuls da CPU e desliga o autograd (só fazemos inferência)
+    torch.set_num_threads(threads_per_worker())
+    torch.set_grad_enabled(False)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = SentenceTransformer(model_name, device=device)
+    if device == "cuda":
+        model.half()
+
+    #o modo de gradiente é por thread e o encode também roda em threads do executor,
+    #então cada chamada entra no inference_mode por conta própria
+    encode = model.encode
+
+    @wraps(encode)
+    def encode_inference(*args, **kwargs):
+        with torch.inference_mode():
+            return encode(*args, **kwargs)
+
+    model.encode = encode_inference
+    return model
+
+#na GPU usa o SentenceTransformer em FP16; na CPU usa o modelo ONNX INT8 se ele já foi exportado
+@lru_cache(maxsize=None)
+def load_embed_model(model_name: str, onnx_dir: str = ONNX_DIR):
+    import torch
+
+    if not torch.cuda.is_available():
+        if os.path.exists(os.path.join(onnx_dir, ONNX_MODEL_FILE)):
+            return OnnxEmbedder(onnx_dir)
+        print(f"Modelo ONNX não encontrado em {onnx_dir}, usando SentenceTransformer. Execute embedder.py para exportar.")
+    return load_sentence_transformer(model_name)
+
+if __name__ == "__main__":
+    export_onnx_model()
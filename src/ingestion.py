@@ -1,49 +1,63 @@
 import os 
+from concurrent.futures import ThreadPoolExecutor
+
+#Lê um arquivo .txt e retorna (nome do arquivo, conteúdo)
+def read_document(file_path: str) -> tuple[str, str]:
+    with open (file_path, "r", encoding="utf-8") as f:
+        return os.path.basename(file_path), f.read()
 
 #Lê os arquivos .txt em um diretório e retorna um dicionário
 def load_documents(folder_path: str) ->dict:             
 
-    docs = {}
-    for file_name in os.listdir(folder_path):
-        if file_name.lower().endswith(".txt"):
-            file_path = os.path.join(folder_path,file_name)
-            with open (file_path, "r", encoding="utf-8") as f:
-                text = f.read()
-            docs[file_name] = text
-    return docs
+    #scandir já traz o tipo de cada entrada, sem um stat() extra por arquivo
+    with os.scandir(folder_path) as it:
+        file_paths = [e.path for e in it if e.is_file() and e.name.lower().endswith(".txt")]
+    if not file_paths:
+        return {}
+
+    #leituras em paralelo para sobrepor o I/O de disco
+    with ThreadPoolExecutor(max_workers=min(32, len(file_paths))) as ex:
+        return dict(ex.map(read_document, file_paths))
 
 #Divide o texto em chunks de até max_chars preservando paragrafo e retorna um lista de chunks
 def split_into_chunk(text: str, max_chars: int = 100) -> list[str]:    
 
-    #separa paragrafo
-    raw_paragraphs = text.split("\n\n")
     chunks = []
-    current_chunk = ""
-    for para in raw_paragraphs:
+    #paragrafos vizinhos são separados por exatamente "\n\n" no texto original, então
+    #o chunk atual é sempre a fatia text[chunk_start:chunk_end] e só é copiado quando emitido
+    chunk_start = chunk_end = 0
+    n = len(text)
+    start = 0
+    while True:
+        #localiza o proximo paragrafo sem montar a lista inteira de paragrafos
+        end = text.find("\n\n", start)
+        if end == -1:
+            end = n
+        para_len = end - start
+        chunk_len = chunk_end - chunk_start
+
         #se o paragrafo atual for maior que max_chars fais split
-        if len(para)> max_chars:
-            for i in range (0,len(para), max_chars):
-                chunks_piece = para[i : i + max_chars]
-                if current_chunk:
-                    chunks.append(current_chunk)
-                    current_chunk = ""
-                chunks.append(chunks_piece)
+        if para_len > max_chars:
+            if chunk_len:
+                chunks.append(text[chunk_start:chunk_end])
+            chunk_start = chunk_end = end
+            chunks.extend(text[i : min(i + max_chars, end)] for i in range(start, end, max_chars))
 
+        #verifica se adicioanar esse paragrafo ao chunk atual exede o limite, se sim salva o chunk atual e inicia um novo
+        elif not chunk_len or chunk_len + para_len + 2 > max_chars:
+            if chunk_len:
+                chunks.append(text[chunk_start:chunk_end])
+            chunk_start, chunk_end = start, end
         else:
-            #verifica se adicioanar esse paragrafo ao chunk atual exede o limite, se sim salva em current_chunk e inicia um novo
-            if len(current_chunk) + len(para) + 2 > max_chars:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = para
-            else:
-                if current_chunk:
-                    current_chunk += "\n\n" + para
-                else:
-                    current_chunk = para
+            chunk_end = end
+
+        if end == n:
+            break
+        start = end + 2
 
     #adicionando o resto dos chunks 
-    if current_chunk:
-        chunks.append(current_chunk)
+    if chunk_end > chunk_start:
+        chunks.append(text[chunk_start:chunk_end])
     return chunks
 
 if __name__ == "__main__":
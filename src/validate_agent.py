@@ -1,28 +1,50 @@
-from typing import List, Tuple
+import re
+from typing import List, Optional, Tuple
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from embedder import load_embed_model
 import faiss
 
 # Parâmetros de validação
 MAX_CHARS = 5000   # tamanho máximo da resposta em caracteres
 SIMILARITY_THRESHOLD = 0.1  
+OVERLAP_PREFIX_CHARS = 50   # início do chunk que, se aparecer literalmente na resposta, já a valida
+JACCARD_THRESHOLD = 0.3     # sobreposição de palavras resposta x chunk que já valida a resposta
+MIN_OVERLAP_WORDS = 5       # palavras distintas mínimas na resposta e no chunk para usar o Jaccard
 EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
 
 #Carregar modelo de embeddings
-embed_model = SentenceTransformer(EMBED_MODEL_NAME)
+embed_model = load_embed_model(EMBED_MODEL_NAME)
 
-#calcula similaridade do cosseno entre dois vetores a e b.
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+#checagem barata de sobreposição textual; devolve o motivo se a resposta claramente usa algum chunk
+def lexical_overlap(llm_output: str, retrieved_texts: List[str]) -> Optional[str]:
+    normalized = llm_output.lower()
+    resp_words = set(normalized.split())
 
-    if np.all(a == 0) or np.all(b == 0):
-        return 0.0
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    for i, chunk in enumerate(retrieved_texts):
+        chunk_lower = chunk.lower().strip()
+
+        #chunks curtos (ex.: restos de paragrafos longos) casariam com quase qualquer resposta
+        if len(chunk_lower) >= OVERLAP_PREFIX_CHARS:
+            #estende o prefixo até o fim da palavra em que ele termina e exige limites de palavra
+            word_end = re.match(r"\w*", chunk_lower[OVERLAP_PREFIX_CHARS:]).end()
+            prefix = chunk_lower[:OVERLAP_PREFIX_CHARS + word_end]
+            if re.search(r"(?<!\w)" + re.escape(prefix) + r"(?!\w)", normalized):
+                return f"Resposta contém trecho literal do chunk {i+1}."
+
+        chunk_words = set(chunk_lower.split())
+        if len(resp_words) < MIN_OVERLAP_WORDS or len(chunk_words) < MIN_OVERLAP_WORDS:
+            continue
+        jaccard = len(resp_words & chunk_words) / len(resp_words | chunk_words)
+        if jaccard > JACCARD_THRESHOLD:
+            return f"Sobreposição de palavras com o chunk {i+1} ({jaccard:.3f} > {JACCARD_THRESHOLD})."
+    return None
 
 #Valida a resposta da LLM
 def validate_llm_output(
     llm_output: str, 
     question: str, 
-    retrieved_texts: List[str]
+    retrieved_texts: List[str],
+    chunk_embs: Optional[np.ndarray] = None
 ) -> Tuple[bool, dict]:
    
     info = {}
@@ -31,19 +53,39 @@ def validate_llm_output(
         info["reason"] = f"Resposta excede {MAX_CHARS} caracteres (tamanho={len(llm_output)})."
         return False, info
 
-    # 2. Similaridade semântica
-    resp_emb = embed_model.encode([llm_output], convert_to_numpy=True)[0]  # shape (dim,)
-    # Para cada chunk recuperado, gerar embedding
-    chunk_embs = embed_model.encode(retrieved_texts, convert_to_numpy=True)  # shape (K, dim)
+    if not llm_output.strip():
+        info["reason"] = "Resposta vazia."
+        return False, info
+
+    # 2. Sobreposição textual: se a resposta claramente usa o contexto, dispensa os embeddings
+    overlap_reason = lexical_overlap(llm_output, retrieved_texts)
+    if overlap_reason is not None:
+        info["reason"] = f"Validação bem‐sucedida (checagem rápida). {overlap_reason}"
+        return True, info
+
+    # 3. Similaridade semântica
+    if chunk_embs is None:
+        # Resposta e chunks recuperados embedados num único forward pass
+        all_texts = [llm_output] + retrieved_texts
+        embs = embed_model.encode(all_texts, convert_to_numpy=True, batch_size=len(all_texts))
+        embs = np.ascontiguousarray(embs, dtype=np.float32)
+        faiss.normalize_L2(embs)
+        resp_emb = embs[0]     # shape (dim,)
+        chunk_embs = embs[1:]  # shape (K, dim)
+    else:
+        # Embeddings dos chunks já calculados (e normalizados) na indexação, só falta a resposta
+        resp_emb = embed_model.encode([llm_output], convert_to_numpy=True)
+        resp_emb = np.ascontiguousarray(resp_emb, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(resp_emb)
+        resp_emb = resp_emb[0]
+        chunk_embs = np.asarray(chunk_embs, dtype=np.float32).reshape(-1, resp_emb.shape[0])
 
-    # Calcular similaridades cosseno
-    sims = []
-    for emb in chunk_embs:
-        sims.append(cosine_similarity(resp_emb, emb))
-    avg_sim = float(np.mean(sims)) if sims else 0.0
+    # Vetores unitários: similaridade cosseno = produto interno (vetores zerados resultam em 0)
+    sims = chunk_embs @ resp_emb  # shape (K,)
+    avg_sim = float(sims.mean()) if sims.size else 0.0
 
     info["average_similarity_with_chunks"] = avg_sim
-    info["individual_similarities"] = sims
+    info["individual_similarities"] = sims.tolist()
 
     if avg_sim < SIMILARITY_THRESHOLD:
         info["reason"] = (